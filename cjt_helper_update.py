@@ -4,113 +4,685 @@
 CJT Helper 自动更新脚本（Native Messaging Host）
 """
 
+import atexit
+import concurrent.futures
+import contextlib
+import functools
+import io
 import json
 import os
+import queue
+import select
 import shutil
+import stat
 import struct
 import sys
 import tempfile
 import threading
+import time
+import urllib.error
 import urllib.request
 import zipfile
 
-CHUNK_SIZE = 64 * 1024
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，stdout 保持阻塞写入
+    fcntl = None
+
+try:
+    from stream_unzip import UnzipError, stream_unzip
+except ImportError:
+    # 未安装 stream-unzip 时，大更新包仍走先下载后解压的流程
+    UnzipError = None
+    stream_unzip = None
+
+CHUNK_SIZE = 1024 * 1024
+# 进度消息最小发送间隔（秒），限制发往 Chrome 的消息频率
+PROGRESS_INTERVAL = 0.05
+PROGRESS_TEXT = {
+    'download': '正在下载更新包（{}%）',
+    'extract': '正在解压更新包（{}%）',
+}
+# 未知总大小时，每下载该字节数上报一次进度（与原 64 KiB * 20 的节奏一致）
+UNSIZED_PROGRESS_BYTES = 64 * 1024 * 20
+# 不超过该大小的更新包直接在内存中下载和解压，不落临时文件
+MEMORY_DOWNLOAD_LIMIT = 64 * 1024 * 1024
+# 并行解压的最大线程数
+EXTRACT_WORKERS = 4
 send_lock = threading.Lock()
-update_lock = threading.Lock()
 cancel_event = threading.Event()
-update_thread = None
+# 常驻更新线程的任务队列；update_running 覆盖任务排队到执行结束的整个区间
+job_q = queue.Queue(maxsize=1)
+update_running = threading.Event()
+# stdout 是否已切换为非阻塞模式（仅 POSIX）
+stdout_nonblocking = False
+# Native Messaging 输入的复用接收缓冲区
+rx_buffer = bytearray(4096)
 LOG_FILE = os.path.expanduser('~/.cjt-helper/auto-update.log')
+# 按更新目录记录最近一次成功安装的下载地址及其 ETag / Last-Modified，用于条件请求
+UPDATE_CACHE_FILE = os.path.expanduser('~/.cjt-helper/update-cache.json')
+# 主循环等待 Chrome 输入的轮询间隔（秒）
+INPUT_POLL_INTERVAL = 0.25
+# 日志批量写入间隔（秒）
+LOG_FLUSH_INTERVAL = 0.25
+# 待写入的日志行，由后台线程批量落盘；None 表示停止
+log_q = queue.Queue()
+# 允许清理的安全根目录，模块加载时规范化一次
+SAFE_ROOT = os.path.normcase(os.path.normpath(os.path.join(os.path.expanduser('~'), '.cjt-helper')))
 
 
 class UpdateCanceled(Exception):
     """用于中断更新流程的取消异常。"""
 
 
+class AlreadyCurrent(Exception):
+    """服务器返回 304，本地安装的已是最新更新包。"""
+
+
+def encode_message(payload):
+    """将消息编码为 UTF-8 JSON。"""
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+@functools.lru_cache(maxsize=256)
+def encode_progress(phase, percent):
+    """编码进度消息并缓存结果，高频进度上报时跳过重复的 json.dumps。"""
+    return encode_message({
+        'status': 'progress',
+        'phase': phase,
+        'percent': percent,
+        'text': PROGRESS_TEXT[phase].format(percent)
+    })
+
+
+@functools.lru_cache(maxsize=1)
+def encode_unsized_progress():
+    """编码未知总大小时的下载进度消息，内容固定，只编码一次。"""
+    return encode_message({
+        'status': 'progress',
+        'phase': 'download',
+        'percent': 0,
+        'text': '正在下载更新包...'
+    })
+
+
 def send_message(payload):
     """发送消息到 Chrome（遵循 Native Messaging 长度前缀协议）。"""
-    data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    send_data(encode_message(payload))
+
+
+def send_progress(phase, percent):
+    """发送下载或解压阶段的进度消息，Chrome 暂不读取时允许丢弃。"""
+    send_data(encode_progress(phase, percent), droppable=True)
+
+
+def send_data(data, droppable=False):
+    """写出已编码的消息体。"""
+    # 长度前缀与消息体合并为一次写入，Chrome 端不会读到半条消息
+    frame = struct.pack('<I', len(data)) + data
     # 多线程场景下保证写入原子性，避免消息交错
     with send_lock:
-        sys.stdout.buffer.write(struct.pack('<I', len(data)))
-        sys.stdout.buffer.write(data)
-        sys.stdout.buffer.flush()
+        if stdout_nonblocking:
+            write_frame(frame, droppable)
+        else:
+            sys.stdout.buffer.write(frame)
+            sys.stdout.buffer.flush()
+
+
+def write_frame(frame, droppable):
+    """向非阻塞 stdout 写出完整的一帧，返回是否已写出。"""
+    fd = sys.stdout.fileno()
+    view = memoryview(frame)
+    offset = 0
+    while offset < len(frame):
+        try:
+            offset += os.write(fd, view[offset:])
+        except BlockingIOError:
+            # 管道已满：尚未写出的进度消息直接丢弃，会被下一次进度覆盖；
+            # 已写出一部分或终态消息必须写完，否则协议错位或状态丢失
+            if droppable and offset == 0:
+                return False
+            select.select([], [fd], [])
+    return True
+
+
+def set_stdout_nonblocking():
+    """将 stdout 管道设为非阻塞，避免 Chrome 不读取时进度上报卡住更新线程。"""
+    global stdout_nonblocking
+    if fcntl is None:
+        return
+    try:
+        sys.stdout.flush()
+        fd = sys.stdout.fileno()
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    except (OSError, ValueError) as error:
+        write_log(f'stdout_nonblocking_error: {error}')
+        return
+    stdout_nonblocking = True
 
 
 def write_log(text):
     """写入本地日志，便于排查 Native Host 是否启动。"""
+    # 仅入队不落盘，避免在更新主流程上产生文件 IO
+    log_q.put_nowait(text)
+
+
+def write_log_lines(lines):
+    """一次打开日志文件追加多行。"""
     try:
         os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
         with open(LOG_FILE, 'a', encoding='utf-8') as handler:
-            handler.write(text + '\n')
+            handler.write(''.join(line + '\n' for line in lines))
     except Exception:
         # 日志失败不影响更新主流程
         pass
 
 
+def log_worker():
+    """后台日志线程：每 LOG_FLUSH_INTERVAL 秒合并写入一批日志，收到 None 后退出。"""
+    while True:
+        lines = [log_q.get()]
+        time.sleep(LOG_FLUSH_INTERVAL)
+        try:
+            while True:
+                lines.append(log_q.get_nowait())
+        except queue.Empty:
+            pass
+        stop = None in lines
+        write_log_lines([line for line in lines if line is not None])
+        if stop:
+            return
+
+
+def start_log_worker():
+    """启动日志线程，并在进程退出前写完剩余日志。"""
+    thread = threading.Thread(target=log_worker, daemon=True)
+    thread.start()
+
+    def stop_log_worker():
+        log_q.put_nowait(None)
+        thread.join(timeout=2)
+
+    atexit.register(stop_log_worker)
+
+
+def read_into(view):
+    """从 stdin 读满 view，返回实际读取的字节数（提前遇到 EOF 时不足）。"""
+    # 直接读取底层无缓冲流，避免数据滞留在 Python 缓冲区中而 select 感知不到
+    stream = sys.stdin.buffer.raw
+    received = 0
+    while received < len(view):
+        size = stream.readinto(view[received:])
+        if not size:
+            break
+        received += size
+    return received
+
+
+def wait_for_input(timeout):
+    """等待 stdin 可读，超时返回 False；Windows 的 select 不支持管道，直接返回 True 阻塞读取。"""
+    if os.name == 'nt':
+        return True
+    readable, _, _ = select.select([sys.stdin.buffer.raw], [], [], timeout)
+    return bool(readable)
+
+
 def read_message():
     """读取来自 Chrome 的消息。"""
-    raw_length = sys.stdin.buffer.read(4)
-    if not raw_length:
+    global rx_buffer
+    raw_length = bytearray(4)
+    if read_into(memoryview(raw_length)) < 4:
         return None
-    message_length = struct.unpack('<I', raw_length)[0]
-    message_data = sys.stdin.buffer.read(message_length)
-    if not message_data:
+    message_length = struct.unpack_from('<I', raw_length)[0]
+    # 接收缓冲区只在消息超过历史最大长度时扩容，避免每条消息都分配新的 bytes
+    if message_length > len(rx_buffer):
+        rx_buffer = bytearray(message_length)
+    view = memoryview(rx_buffer)[:message_length]
+    received = read_into(view)
+    if not received:
         return None
-    return json.loads(message_data.decode('utf-8'))
+    return json.loads(bytes(view[:received]).decode('utf-8'))
+
+
+class ProgressWriter:
+    """包装下载目标文件，在写入时检查取消标记并按节奏上报下载进度。"""
+
+    def __init__(self, fp, total):
+        self.fp = fp
+        self.total = total
+        self.downloaded = 0
+        self.last_percent = -1
+        self.last_ts = 0.0
+        self.next_report = UNSIZED_PROGRESS_BYTES
+
+    def write(self, data):
+        if cancel_event.is_set():
+            raise UpdateCanceled('已取消自动更新')
+        self.fp.write(data)
+        self.advance(len(data))
+        return len(data)
+
+    def advance(self, size):
+        self.downloaded += size
+        self.report()
+
+    def report(self):
+        if self.total > 0:
+            percent = int(self.downloaded * 100 / self.total)
+            now = time.monotonic()
+            # 百分比变化且距上次发送超过间隔时才上报，100% 总是上报
+            if percent != self.last_percent and (percent >= 100 or now - self.last_ts >= PROGRESS_INTERVAL):
+                self.last_percent = percent
+                self.last_ts = now
+                send_progress('download', percent)
+        elif self.downloaded >= self.next_report:
+            self.next_report = self.downloaded + UNSIZED_PROGRESS_BYTES
+            send_data(encode_unsized_progress(), droppable=True)
+
+
+def copy_stream(src, dst):
+    """将 src 复制到 dst，优先复用同一块缓冲区（readinto），避免每块分配新的 bytes。"""
+    if not hasattr(src, 'readinto'):
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        return
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    while True:
+        size = src.readinto(view)
+        if not size:
+            break
+        dst.write(view[:size])
+
+
+def iter_response(response, progress):
+    """逐块产出响应体，产出前先经 progress 写入临时文件并上报下载进度。"""
+    while True:
+        if cancel_event.is_set():
+            raise UpdateCanceled('已取消自动更新')
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        progress.write(chunk)
+        yield chunk
+
+
+def stream_to_staging(response, progress, target_dir):
+    """边下载边解压，网络与解压重叠进行，返回 (staging, entries)。
+
+    每个条目按其在压缩包中出现的顺序暂存为 staging 下以序号命名的文件，
+    entries 为 (原始文件名, 暂存路径) 列表，目录条目的暂存路径为 None。
+    真正的落盘路径和权限由 match_staged / install_staged 依据 zipfile 读出的
+    中央目录决定，保证与 zipfile 解压得到的目录树一致。
+    stream-unzip 无法解析的压缩包（如带数据描述符的 stored 条目）或无法创建暂存目录时返回 None，
+    此时已下载的数据都在临时文件中，由调用方改走 zipfile 解压。
+    """
+    parent = os.path.dirname(os.path.abspath(target_dir))
+    try:
+        staging = tempfile.mkdtemp(prefix='.cjt_helper_update_', dir=parent)
+    except OSError as error:
+        # 父目录不可写（如用户授权的 Program Files 下插件目录）时改走临时文件 + zipfile 解压
+        write_log(f'stream_unzip_fallback: {error!r}')
+        return None
+    entries = []
+    try:
+        for raw_name, _, unzipped_chunks in stream_unzip(iter_response(response, progress)):
+            if raw_name.endswith(b'/'):
+                # stream_unzip 要求每个成员的数据都被完整消费
+                for _ in unzipped_chunks:
+                    pass
+                entries.append((raw_name, None))
+                continue
+            staged_path = os.path.join(staging, str(len(entries)))
+            with open(staged_path, 'wb', buffering=CHUNK_SIZE) as dst:
+                for chunk in unzipped_chunks:
+                    if cancel_event.is_set():
+                        raise UpdateCanceled('已取消自动更新')
+                    dst.write(chunk)
+            entries.append((raw_name, staged_path))
+    except UnzipError as error:
+        write_log(f'stream_unzip_fallback: {error!r}')
+        shutil.rmtree(staging, ignore_errors=True)
+        return None
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return staging, entries
+
 
+def match_staged(source, entries):
+    """将暂存文件对应到压缩包成员，返回 {header_offset: 暂存路径}；对应不上时返回 None。
 
-def download_with_progress(url, dest_path):
-    """下载更新包，并实时上报下载进度。"""
-    request = urllib.request.Request(url, headers={'User-Agent': 'cjt-helper-updater'})
-    with urllib.request.urlopen(request) as response, open(dest_path, 'wb') as target:
+    stream-unzip 按本地文件头在文件中的顺序产出条目，即按 header_offset 排序的 infolist。
+    """
+    with open_archive(source) as archive:
+        members = sorted(archive.infolist(), key=lambda member: member.header_offset)
+    if len(members) != len(entries):
+        return None
+    staged = {}
+    for member, (raw_name, staged_path) in zip(members, entries):
+        # 按 zipfile 的规则（UTF-8 标志位 0x800）还原原始文件名字节后比对
+        encoding = 'utf-8' if member.flag_bits & 0x800 else 'cp437'
+        if member.orig_filename.encode(encoding) != raw_name:
+            return None
+        if (staged_path is None) != member.is_dir():
+            return None
+        if staged_path is not None:
+            staged[member.header_offset] = staged_path
+    return staged
+
+
+def move_file(src, dst):
+    """移动文件并覆盖目标，跨文件系统时退回复制。"""
+    try:
+        os.replace(src, dst)
+    except OSError:
+        shutil.move(src, dst)
+
+
+def install_staged(plan, staged):
+    """按解压计划将暂存文件移入目标目录，目录与权限处理与 extract_with_progress 一致。"""
+    dirs, files = plan
+    for path in sorted(dirs, key=len):
+        os.makedirs(path, exist_ok=True)
+    for member, out_path in files:
+        if cancel_event.is_set():
+            raise UpdateCanceled('已取消自动更新')
+        move_file(staged[member.header_offset], out_path)
+        apply_member_mode(member, out_path)
+
+
+def download_with_progress(url, target_dir):
+    """下载更新包，并实时上报下载进度，返回 (source, staged, validators)。
+
+    小于 MEMORY_DOWNLOAD_LIMIT 的更新包 source 为内存中的 bytes；
+    其余情况写入临时文件，source 为其路径，由调用方负责删除。
+    安装了 stream-unzip 时，写临时文件的同时边下载边解压，staged 为
+    stream_to_staging 的结果（同样由调用方删除），否则为 None。
+    validators 为响应的 ETag / Last-Modified；服务器返回 304 时抛出 AlreadyCurrent。
+    """
+    if cancel_event.is_set():
+        raise UpdateCanceled('已取消自动更新')
+    headers = {'User-Agent': 'cjt-helper-updater'}
+    headers.update(conditional_headers(url, target_dir))
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as error:
+        if error.code == 304:
+            raise AlreadyCurrent()
+        raise
+    with response:
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
         total = int(response.headers.get('Content-Length') or 0)
-        downloaded = 0
-        last_percent = -1
-        while True:
+        if 0 < total <= MEMORY_DOWNLOAD_LIMIT:
+            buffer = io.BytesIO()
+            # Python 层每 CHUNK_SIZE 只执行一次进度逻辑，且全程复用同一块缓冲区
+            copy_stream(response, ProgressWriter(buffer, total))
+            return buffer.getvalue(), None, validators
+
+        fd, dest_path = tempfile.mkstemp(prefix='cjt_helper_update_', suffix='.zip')
+        staged = None
+        try:
+            # 与 CHUNK_SIZE 一致的写缓冲，每个块只触发一次 write 系统调用
+            with open(fd, 'wb', buffering=CHUNK_SIZE) as target:
+                progress = ProgressWriter(target, total)
+                if stream_unzip is not None:
+                    staged = stream_to_staging(response, progress, target_dir)
+                # 边下载边解压失败或未读完响应时，剩余数据继续写入临时文件
+                copy_stream(response, progress)
+                # 下载结束后统一落盘一次，确保解压前数据完整
+                target.flush()
+                os.fsync(target.fileno())
+        except BaseException:
+            remove_file(dest_path)
+            if staged is not None:
+                shutil.rmtree(staged[0], ignore_errors=True)
+            raise
+        return dest_path, staged, validators
+
+
+def load_update_cache():
+    """读取条件请求缓存，文件缺失或损坏时视为空。"""
+    try:
+        with open(UPDATE_CACHE_FILE, 'r', encoding='utf-8') as handler:
+            cache = json.load(handler)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def write_update_cache(cache):
+    """整体写回条件请求缓存，先写临时文件再替换，避免写到一半留下损坏的文件。"""
+    temp_path = UPDATE_CACHE_FILE + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(UPDATE_CACHE_FILE), exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as handler:
+            json.dump(cache, handler, ensure_ascii=False)
+        os.replace(temp_path, UPDATE_CACHE_FILE)
+    except OSError as error:
+        # 缓存失败只会导致下次完整下载，不影响更新主流程
+        write_log(f'update_cache_error: {error}')
+
+
+def update_cache_key(target_dir):
+    """缓存以更新目录为键：目录中的内容只属于最后一次安装到这里的下载地址。"""
+    return os.path.normcase(os.path.abspath(target_dir))
+
+
+def save_update_cache(url, target_dir, validators):
+    """记录本次成功安装的下载地址及其 ETag / Last-Modified，覆盖该目录之前的记录。"""
+    if not validators.get('etag') and not validators.get('last_modified'):
+        forget_update_cache(target_dir)
+        return
+    cache = load_update_cache()
+    cache[update_cache_key(target_dir)] = {
+        'url': url,
+        'etag': validators.get('etag'),
+        'last_modified': validators.get('last_modified'),
+        'installed_at': int(time.time()),
+    }
+    write_update_cache(cache)
+
+
+def forget_update_cache(target_dir):
+    """删除更新目录对应的缓存记录，下次更新强制完整下载。"""
+    cache = load_update_cache()
+    if cache.pop(update_cache_key(target_dir), None) is not None:
+        write_update_cache(cache)
+
+
+def conditional_headers(url, target_dir):
+    """根据缓存生成条件请求头；仅当该目录最近一次安装的正是同一下载地址且目录仍有内容时才使用。"""
+    entry = load_update_cache().get(update_cache_key(target_dir))
+    if not isinstance(entry, dict) or entry.get('url') != url:
+        return {}
+    # 目录已被清空或删除时必须重新下载
+    if not os.path.isdir(target_dir) or not os.listdir(target_dir):
+        return {}
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def remove_file(path):
+    """删除临时文件，忽略删除失败。"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def advise_file(fd, advice_name):
+    """向内核提示文件访问模式，不支持 posix_fadvise 的平台（如 Windows）直接跳过。"""
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def open_archive(source):
+    """打开更新包，source 为内存中的 bytes 或磁盘上的文件路径。"""
+    if isinstance(source, bytes):
+        # 每次包装新的 BytesIO，各线程拥有独立的读取位置，底层数据共享不复制
+        with zipfile.ZipFile(io.BytesIO(source), 'r') as archive:
+            yield archive
+        return
+    with open(source, 'rb') as handler:
+        # 更新包只顺序读一遍，提示内核加大预读
+        advise_file(handler.fileno(), 'POSIX_FADV_SEQUENTIAL')
+        with zipfile.ZipFile(handler, 'r') as archive:
+            yield archive
+
+
+def resolve_member_path(root, name):
+    """计算压缩包成员的落盘路径，拒绝越出解压目录的条目。
+
+    root 须为已规范化的绝对路径，由调用方对整个压缩包只计算一次。
+    """
+    out_path = os.path.normpath(os.path.join(root, name))
+    if out_path != root and not out_path.startswith(root + os.sep):
+        raise RuntimeError(f'更新包包含非法路径: {name}')
+    return out_path
+
+
+def copy_member(src, dst):
+    """按块复制单个成员，块间检查取消标记，避免大文件解压时无法及时取消。"""
+    while True:
+        if cancel_event.is_set():
+            raise UpdateCanceled('已取消自动更新')
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        dst.write(chunk)
+
+
+class ExtractCounter:
+    """线程安全的解压进度计数器，由解压线程累加、主线程读取。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, size):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+
+    def snapshot(self):
+        with self.lock:
+            return self.files, self.bytes
+
+
+def build_extract_plan(members, target_dir):
+    """预先计算所有成员的落盘路径，返回需创建的目录集合与 (成员, 路径) 文件列表。"""
+    root = os.path.abspath(target_dir)
+    dirs = set()
+    files = []
+    for member in members:
+        out_path = resolve_member_path(root, member.filename)
+        if member.is_dir():
+            dirs.add(out_path)
+        else:
+            dirs.add(os.path.dirname(out_path))
+            files.append((member, out_path))
+    return dirs, files
+
+
+def extract_member(archive, member, out_path):
+    """解压单个文件成员到已计算好的路径，所在目录需预先创建。"""
+    # 流式写入磁盘，峰值内存仅为一个块大小
+    with archive.open(member) as src, open(out_path, 'wb') as dst:
+        copy_member(src, dst)
+    apply_member_mode(member, out_path)
+
+
+def apply_member_mode(member, out_path):
+    """按压缩包中记录的 Unix 权限位设置文件权限（如可执行位）。"""
+    if os.name == 'nt':
+        # Windows 上缺少属主写位的模式会设置只读属性，导致下次更新无法清理旧文件
+        return
+    mode = (member.external_attr >> 16) & 0o777
+    if mode:
+        os.chmod(out_path, mode)
+
+
+def extract_members(source, files, counter, abort):
+    """解压线程入口：ZipFile 非线程安全，每个线程独立打开压缩包。"""
+    with open_archive(source) as archive:
+        for member, out_path in files:
             if cancel_event.is_set():
                 raise UpdateCanceled('已取消自动更新')
-            chunk = response.read(CHUNK_SIZE)
-            if not chunk:
-                break
-            target.write(chunk)
-            downloaded += len(chunk)
-            if total > 0:
-                percent = int(downloaded * 100 / total)
-                if percent != last_percent:
-                    last_percent = percent
-                    send_message({
-                        'status': 'progress',
-                        'phase': 'download',
-                        'percent': percent,
-                        'text': f'正在下载更新包（{percent}%）'
-                    })
-            elif downloaded % (CHUNK_SIZE * 20) == 0:
-                send_message({
-                    'status': 'progress',
-                    'phase': 'download',
-                    'percent': 0,
-                    'text': '正在下载更新包...'
-                })
+            if abort.is_set():
+                return
+            extract_member(archive, member, out_path)
+            counter.add(member.file_size)
 
 
-def extract_with_progress(zip_path, target_dir):
-    """解压更新包，并实时上报解压进度。"""
-    with zipfile.ZipFile(zip_path, 'r') as archive:
+def load_extract_plan(source, target_dir):
+    """打开更新包并生成解压计划；压缩包损坏或含非法路径时抛出异常。
+
+    须在清理目标目录之前调用，保证被拒绝的更新包不会清空旧版本。
+    """
+    with open_archive(source) as archive:
         members = archive.infolist()
-        total = len(members)
-        if total == 0:
-            return
-        for index, member in enumerate(members, 1):
-            if cancel_event.is_set():
-                raise UpdateCanceled('已取消自动更新')
-            archive.extract(member, target_dir)
-            percent = int(index * 100 / total)
-            send_message({
-                'status': 'progress',
-                'phase': 'extract',
-                'percent': percent,
-                'text': f'正在解压更新包（{percent}%）'
-            })
+    return build_extract_plan(members, target_dir)
+
+
+def extract_with_progress(source, plan):
+    """按 load_extract_plan 生成的计划解压更新包，并实时上报解压进度。"""
+    dirs, files = plan
+    # 目录按路径长度排序一次性创建，父目录总在子目录之前
+    for path in sorted(dirs, key=len):
+        os.makedirs(path, exist_ok=True)
+    total = len(files)
+    if total == 0:
+        return
+
+    # 按解压后字节数计算进度，避免大文件与大量小文件混合时进度失真
+    total_bytes = sum(member.file_size for member, _ in files)
+    worker_count = max(1, min(EXTRACT_WORKERS, os.cpu_count() or 1, total))
+    counter = ExtractCounter()
+    abort = threading.Event()
+    last_percent = -1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+        futures = [
+            executor.submit(extract_members, source, files[index::worker_count], counter, abort)
+            for index in range(worker_count)
+        ]
+        try:
+            while True:
+                # 进度统一由主线程轮询上报，解压线程不直接争用 send_lock
+                done, pending = concurrent.futures.wait(
+                    futures, timeout=PROGRESS_INTERVAL, return_when=concurrent.futures.FIRST_EXCEPTION)
+                done_files, written = counter.snapshot()
+                if total_bytes > 0:
+                    percent = written * 100 // total_bytes
+                else:
+                    percent = done_files * 100 // total
+                if percent != last_percent:
+                    last_percent = percent
+                    send_progress('extract', percent)
+                for future in done:
+                    future.result()
+                if not pending:
+                    break
+        except BaseException:
+            # 任一线程失败或取消时通知其余线程尽快退出
+            abort.set()
+            raise
 
 
 def resolve_target_dir(message):
@@ -128,32 +700,53 @@ def ensure_clean_target_dir(target_dir):
         return
 
     # 安全保护：仅清理 ~/.cjt-helper 或以 cjt-helper 结尾的目录
-    home_dir = os.path.expanduser('~')
-    safe_root = os.path.join(home_dir, '.cjt-helper')
-    try:
-        is_under_safe_root = os.path.commonpath([target_dir, safe_root]) == safe_root
-    except Exception as error:
-        write_log(f'skip_clean_error: {error}')
-        return
+    normalized = os.path.normcase(os.path.normpath(target_dir))
+    is_under_safe_root = normalized == SAFE_ROOT or normalized.startswith(SAFE_ROOT + os.sep)
 
     # 允许清理以 cjt-helper 结尾的目录（用于插件安装目录）
-    normalized = os.path.normpath(target_dir)
     allow_by_name = os.path.basename(normalized).lower() == 'cjt-helper'
 
     if not is_under_safe_root and not allow_by_name:
         write_log(f'skip_clean: {target_dir}')
         return
 
-    for name in os.listdir(target_dir):
-        item_path = os.path.join(target_dir, name)
-        try:
-            # 删除目录或文件，避免旧内容影响新的解压结果
-            if os.path.isdir(item_path) and not os.path.islink(item_path):
-                shutil.rmtree(item_path)
+    try:
+        if is_link(target_dir):
+            # 目录本身是符号链接或 Windows 目录联接时 rmtree 会拒绝，只清空其指向目录中的内容
+            clear_dir_contents(target_dir)
+        else:
+            # 整目录删除后重建，由 rmtree 统一遍历，避免逐项判断类型
+            shutil.rmtree(target_dir)
+    except OSError as error:
+        raise RuntimeError(f'清理更新目录失败: {error}')
+    os.makedirs(target_dir, exist_ok=True)
+
+
+def is_link(path):
+    """判断路径是否为符号链接或 Windows 目录联接（junction，os.path.islink 识别不到）。"""
+    if os.path.islink(path):
+        return True
+    try:
+        reparse_tag = getattr(os.lstat(path), 'st_reparse_tag', 0)
+    except OSError:
+        return False
+    return reparse_tag == getattr(stat, 'IO_REPARSE_TAG_MOUNT_POINT', None)
+
+
+def clear_dir_contents(path):
+    """删除目录下的所有条目，保留目录本身；子项中的符号链接和目录联接只删除链接。"""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if is_link(entry.path):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    # Windows 上指向目录的链接需要用 rmdir 删除
+                    os.rmdir(entry.path)
+            elif entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
             else:
-                os.remove(item_path)
-        except Exception as error:
-            raise RuntimeError(f'清理更新目录失败: {error}')
+                os.remove(entry.path)
 
 
 def normalize_path(path):
@@ -181,64 +774,87 @@ def handle_start_update(message):
         return
 
     target_dir = resolve_target_dir(message)
-    os.makedirs(target_dir, exist_ok=True)
 
     write_log('start_update: 开始下载更新包')
     send_message({'status': 'log', 'text': '开始下载更新包...'})
 
-    temp_dir = tempfile.mkdtemp(prefix='cjt_helper_update_')
-    zip_path = os.path.join(temp_dir, 'cjt_helper_update.zip')
-
+    archive_source = None
+    staged = None
     try:
-        download_with_progress(download_url, zip_path)
-        # 下载完成后再清理，避免下载失败导致旧包被清空
+        os.makedirs(target_dir, exist_ok=True)
+        archive_source, staged, validators = download_with_progress(download_url, target_dir)
+        # 先读取并校验整个压缩包，再清理旧版本，避免损坏或非法的包导致旧包被清空
+        plan = load_extract_plan(archive_source, target_dir)
+        staged_files = match_staged(archive_source, staged[1]) if staged is not None else None
         ensure_clean_target_dir(target_dir)
-        write_log('download_done: 开始解压')
-        send_message({'status': 'log', 'text': '下载完成，开始解压...'})
-        extract_with_progress(zip_path, target_dir)
+        if staged_files is not None:
+            write_log('download_done: 已边下载边解压，移入更新目录')
+            install_staged(plan, staged_files)
+        else:
+            write_log('download_done: 开始解压')
+            send_message({'status': 'log', 'text': '下载完成，开始解压...'})
+            extract_with_progress(archive_source, plan)
+        save_update_cache(download_url, target_dir, validators)
         write_log(f'complete: {target_dir}')
         send_message({'status': 'complete', 'path': target_dir})
+    except AlreadyCurrent:
+        write_log(f'not_modified: {target_dir}')
+        send_message({'status': 'complete', 'path': target_dir, 'cached': True})
     except UpdateCanceled as error:
+        # 目录可能已被部分改写，下次不再信任缓存
+        forget_update_cache(target_dir)
         write_log(f'canceled: {error}')
         send_message({'status': 'canceled', 'text': str(error)})
     except Exception as error:
+        forget_update_cache(target_dir)
         write_log(f'error: {error}')
         send_message({'status': 'error', 'text': str(error)})
     finally:
-        try:
-            shutil.rmtree(temp_dir)
-        except Exception:
-            pass
+        if isinstance(archive_source, str):
+            remove_file(archive_source)
+        if staged is not None:
+            shutil.rmtree(staged[0], ignore_errors=True)
 
 
-def run_update(message):
-    """在独立线程中执行更新，避免阻塞消息读取。"""
-    global update_thread
-    try:
-        handle_start_update(message)
-    finally:
-        with update_lock:
-            update_thread = None
+def update_worker():
+    """常驻更新线程：逐个取出更新任务执行，避免阻塞消息读取。"""
+    while True:
+        message = job_q.get()
+        try:
+            handle_start_update(message)
+        except Exception as error:
+            # 常驻线程不能因单个任务的异常退出，否则后续更新请求都无人处理
+            write_log(f'worker_error: {error!r}')
+            try:
+                send_message({'status': 'error', 'text': str(error)})
+            except Exception:
+                pass
+        finally:
+            update_running.clear()
 
 
 def main():
-    global update_thread
+    start_log_worker()
     write_log('native host started')
+    set_stdout_nonblocking()
+    threading.Thread(target=update_worker, daemon=True).start()
     while True:
+        # 定时醒来而不是无限阻塞在读取上，便于主线程后续处理其他事件
+        if not wait_for_input(INPUT_POLL_INTERVAL):
+            continue
         message = read_message()
         if message is None:
             break
         cmd = message.get('cmd')
         if cmd == 'start_update':
-            with update_lock:
-                if update_thread and update_thread.is_alive():
-                    write_log('reject: update already running')
-                    send_message({'status': 'error', 'text': '已有更新任务正在执行'})
-                    continue
-                cancel_event.clear()
-                write_log('start_update: thread created')
-                update_thread = threading.Thread(target=run_update, args=(message,), daemon=True)
-                update_thread.start()
+            if update_running.is_set():
+                write_log('reject: update already running')
+                send_message({'status': 'error', 'text': '已有更新任务正在执行'})
+                continue
+            update_running.set()
+            cancel_event.clear()
+            job_q.put_nowait(message)
+            write_log('start_update: job queued')
         elif cmd == 'cancel_update':
             # 设置取消标记，由更新线程在合适时机退出
             cancel_event.set()